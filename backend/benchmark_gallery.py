@@ -0,0 +1,104 @@
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+from embedding_gallery import EmbeddingGallery, PRECISIONS
+
+''' Accuracy drift and memory/throughput benchmark for EmbeddingGallery.
+ The reference is the original float64 cosine similarity that recognize_faces used.
+ MiB is the resident scoring matrix; mmap MiB is the memory-mapped float32 re-rank copy,
+ of which only the candidate rows read per query become resident.
+ Run from the backend directory: python benchmark_gallery.py --synthetic 100000
+'''
+
+def load_data_embeddings(data_dir):
+    """
+    Load the exported section embeddings from the Data/ directory.
+    :param data_dir: Directory containing FaceRecognitionDB.Embeddings_<section>.json files.
+    :return: Tuple of (embeddings, labels).
+    """
+    embeddings = []
+    labels = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.json"))):
+        with open(path) as f:
+            for doc in json.load(f):
+                embeddings.append(doc["embedding"])
+                labels.append(f"{doc.get('section', '')}/{doc['label']}")
+    return np.array(embeddings, dtype=np.float64), labels
+
+def make_queries(gallery, n_queries, noise, rng):
+    """
+    Build query embeddings as noisy copies of random gallery vectors, like a new photo of a known face.
+    """
+    picks = rng.integers(0, len(gallery), size=n_queries)
+    queries = gallery[picks] + rng.normal(0, noise, size=(n_queries, gallery.shape[1]))
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def reference_scores(gallery, queries):
+    """
+    Best float64 cosine match per query, equivalent to the old 1 - scipy cosine loop.
+    """
+    normed = gallery / np.linalg.norm(gallery, axis=1, keepdims=True)
+    best_indices = np.empty(len(queries), dtype=np.int64)
+    best_scores = np.empty(len(queries), dtype=np.float64)
+    for start in range(0, len(queries), 256):
+        scores = queries[start:start + 256] @ normed.T
+        best_indices[start:start + 256] = np.argmax(scores, axis=1)
+        best_scores[start:start + 256] = scores.max(axis=1)
+    return best_indices, best_scores
+
+def run(name, gallery, queries, rerank_k, repeats):
+    """
+    Run every precision against one gallery and print drift, memory and throughput.
+    """
+    ref_indices, ref_scores = reference_scores(gallery, queries)
+    labels = list(range(len(gallery)))
+    print(f"\n{name}: {len(gallery)} vectors x {gallery.shape[1]} dims, {len(queries)} queries")
+    print(f"  {'precision':<10}{'rerank':>7}{'MiB':>10}{'mmap MiB':>10}{'queries/s':>12}{'top1 agree':>12}{'max |dscore|':>14}")
+    print(f"  {'float64':<10}{'-':>7}{gallery.nbytes / 2**20:>10.2f}{'-':>10}{'-':>12}{'-':>12}{'-':>14}")
+
+    for precision in PRECISIONS:
+        for k in sorted({0, rerank_k}) if precision != "float32" else [0]:
+            matcher = EmbeddingGallery(gallery, labels, precision=precision, rerank_k=k)
+            matcher.match(queries[:1])
+
+            start = time.perf_counter()
+            for _ in range(repeats):
+                best_indices, best_scores = matcher.match(queries)
+            elapsed = (time.perf_counter() - start) / repeats
+
+            agree = np.mean(best_indices == ref_indices)
+            drift = np.max(np.abs(best_scores - ref_scores))
+            print(f"  {precision:<10}{k:>7}{matcher.nbytes / 2**20:>10.2f}{matcher.rerank_nbytes / 2**20:>10.2f}"
+                  f"{len(queries) / elapsed:>12.0f}{agree:>12.4f}{drift:>14.6f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized embedding galleries.")
+    parser.add_argument("--data-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Data"))
+    parser.add_argument("--synthetic", type=int, default=100000, help="Synthetic roster size (0 to skip).")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=64, help="Queries per synthetic run, about one classroom photo.")
+    parser.add_argument("--noise", type=float, default=0.03)
+    parser.add_argument("--rerank-k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    data_embeddings, _ = load_data_embeddings(args.data_dir)
+    if len(data_embeddings):
+        queries = make_queries(data_embeddings, 256, args.noise, rng)
+        run("Data/ embeddings", data_embeddings, queries, args.rerank_k, args.repeats)
+    else:
+        print(f"No embeddings found in {args.data_dir}.")
+
+    if args.synthetic:
+        synthetic = rng.normal(size=(args.synthetic, args.dim))
+        synthetic /= np.linalg.norm(synthetic, axis=1, keepdims=True)
+        queries = make_queries(synthetic, args.queries, args.noise, rng)
+        run("Synthetic roster", synthetic, queries, args.rerank_k, args.repeats)
+
+if __name__ == "__main__":
+    main()
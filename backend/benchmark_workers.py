@@ -0,0 +1,112 @@
+import argparse
+import multiprocessing
+import os
+import time
+import cv2
+import numpy as np
+from embedding_gallery import EmbeddingGallery
+from face_detection import FaceDetector
+from shared_gallery import SharedGalleryStore
+from without_uvicorn import collect_images
+
+''' Scaling benchmark for the multi-worker serving mode, from 1 to N worker processes.
+ Each worker loads its own FaceDetector with the cores split between workers, attaches the
+ memory-mapped section gallery from SharedGalleryStore and runs detection plus matching,
+ the same work /detect_and_recognize/ does without the MongoDB and Azure round trips.
+ Example: python benchmark_workers.py "photos/4R/*.jpg" --max-workers 4
+'''
+
+SECTION = "benchmark"
+
+
+def worker(image_paths, threads, precision, share_dir, roster_version, barrier, tasks, done):
+    face_detector = FaceDetector(intra_op_threads=threads)
+    gallery = SharedGalleryStore(precision=precision, share_dir=share_dir).get(SECTION, roster_version, loader=None)
+    frames = [cv2.imread(path) for path in image_paths]
+
+    # Warm up so model loading is not part of the measurement
+    face_detector.detect_faces(frames[0])
+    barrier.wait()
+
+    while True:
+        index = tasks.get()
+        if index is None:
+            break
+        detections, embeddings = face_detector.detect_faces(frames[index])
+        if embeddings:
+            gallery.match(embeddings)
+        done.put(len(detections))
+
+
+def run(num_workers, image_paths, precision, share_dir, roster_version, num_tasks):
+    """
+    Process num_tasks images with num_workers processes and return images/second.
+    """
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(num_workers + 1)
+    tasks = ctx.Queue()
+    done = ctx.Queue()
+
+    processes = [
+        ctx.Process(target=worker, args=(image_paths, threads, precision, share_dir, roster_version, barrier, tasks, done))
+        for _ in range(num_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for i in range(num_tasks):
+        tasks.put(i % len(image_paths))
+    for _ in processes:
+        tasks.put(None)
+    for _ in range(num_tasks):
+        done.get()
+    elapsed = time.perf_counter() - start
+
+    for process in processes:
+        process.join()
+    return threads, num_tasks / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection and recognition throughput for 1 to N workers.")
+    parser.add_argument("inputs", nargs="+", help="Directories, glob patterns or image files.")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--tasks", type=int, default=32, help="Images processed per run.")
+    parser.add_argument("--gallery-size", type=int, default=5000, help="Synthetic section roster size.")
+    parser.add_argument("--precision", default="float32", help="Gallery precision (float32, float16 or int8).")
+    parser.add_argument("--share-dir", default=None, help="Directory for the shared gallery files.")
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.inputs)
+    if not image_paths:
+        print("No images found.")
+        return
+
+    if args.share_dir:
+        store = SharedGalleryStore(precision=args.precision, share_dir=args.share_dir)
+    else:
+        store = SharedGalleryStore(precision=args.precision)
+    roster_version = f"synthetic-{args.gallery_size}-{args.precision}"
+
+    def synthetic_gallery(section):
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(args.gallery_size, 512)).astype(np.float32)
+        labels = [f"student_{i}" for i in range(args.gallery_size)]
+        return roster_version, EmbeddingGallery(embeddings, labels, precision=args.precision, rerank_k=store.rerank_k)
+
+    store.get(SECTION, roster_version, synthetic_gallery)
+
+    print(f"{len(image_paths)} images, {args.tasks} per run, gallery of {args.gallery_size} ({args.precision})")
+    print(f"{'workers':>8}{'threads':>9}{'images/s':>10}{'speedup':>9}")
+    baseline = None
+    for num_workers in range(1, args.max_workers + 1):
+        threads, throughput = run(num_workers, image_paths, args.precision, store.share_dir, roster_version, args.tasks)
+        baseline = baseline or throughput
+        print(f"{num_workers:>8}{threads:>9}{throughput:>10.2f}{throughput / baseline:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
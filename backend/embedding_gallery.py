@@ -0,0 +1,198 @@
+import os
+import tempfile
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+def memmap_copy(array, directory=None):
+    """
+    Copy an array to an unlinked temporary .npy file and return it memory-mapped read-only.
+    Only the pages actually read become resident, and the OS can drop them again under pressure.
+    Windows cannot remove a file that is still mapped, so there the array is kept in memory instead.
+    :param array: Array to move out of process memory.
+    :param directory: Directory for the temporary file (None uses the system temp directory).
+    """
+    if os.name == "nt":
+        return np.array(array)
+
+    fd, path = tempfile.mkstemp(suffix=".npy", dir=directory)
+    os.close(fd)
+    np.save(path, array)
+    mapped = np.load(path, mmap_mode="r")
+    os.remove(path)  # The mapping keeps the data alive until the gallery is dropped
+    return mapped
+
+class EmbeddingGallery:
+    def __init__(self, embeddings, labels, precision="float32", block_size=2048, rerank_k=5, rerank_dir=os.getenv("GALLERY_RERANK_DIR"), rerank_in_memory=False):
+        """
+        Hold a section's embeddings as one matrix for blocked cosine scoring.
+        With float16 or int8 the scoring matrix is quantized with a scale per vector. This saves
+        memory, not time: numpy has no fast int8/float16 matrix multiply, so each block is dequantized
+        into a cache-sized float32 buffer and scored with the float32 BLAS path.
+        The top rerank_k candidates are re-scored against float32 vectors kept in a memory-mapped
+        file, so the float32 copy does not stay resident.
+        :param embeddings: List (or 2D array) of known face embeddings.
+        :param labels: Labels matching the embeddings.
+        :param precision: One of "float32", "float16" or "int8".
+        :param block_size: Number of gallery rows scored per matrix multiply.
+        :param rerank_k: Number of candidates re-scored at full precision (0 disables re-ranking).
+        :param rerank_dir: Directory for the memory-mapped re-rank vectors (None uses the system temp directory).
+        :param rerank_in_memory: Keep the re-rank vectors in memory, for galleries that are short-lived or copied elsewhere.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported gallery precision '{precision}'. Use one of {PRECISIONS}.")
+
+        self.labels = list(labels)
+        self.precision = precision
+        self.block_size = block_size
+        self.rerank_k = rerank_k if precision != "float32" else 0
+
+        full = np.asarray(embeddings, dtype=np.float32).reshape(len(self.labels), -1)
+        norms = np.linalg.norm(full, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        full = full / norms
+
+        if precision == "int8":
+            scales = np.abs(full).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.matrix = np.round(full / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        elif precision == "float16":
+            self.matrix = full.astype(np.float16)
+            self.scales = None
+        else:
+            self.matrix = full
+            self.scales = None
+
+        if precision == "float32":
+            self.full = self.matrix
+        elif self.rerank_k and rerank_in_memory:
+            self.full = full
+        elif self.rerank_k:
+            self.full = memmap_copy(full, rerank_dir)
+        else:
+            self.full = None
+
+    @classmethod
+    def from_arrays(cls, labels, precision, matrix, scales=None, full=None, block_size=2048, rerank_k=5):
+        """
+        Rebuild a gallery around arrays produced by arrays(), without copying them.
+        Used to attach memory-mapped galleries shared between worker processes.
+        """
+        gallery = cls.__new__(cls)
+        gallery.labels = list(labels)
+        gallery.precision = precision
+        gallery.block_size = block_size
+        gallery.rerank_k = rerank_k if full is not None and precision != "float32" else 0
+        gallery.matrix = matrix
+        gallery.scales = scales
+        gallery.full = full if full is not None else (matrix if precision == "float32" else None)
+        return gallery
+
+    def arrays(self):
+        """
+        Arrays backing the gallery, keyed by name, for persisting with from_arrays.
+        """
+        arrays = {"matrix": self.matrix}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+        if self.full is not None and self.full is not self.matrix:
+            arrays["full"] = self.full
+        return arrays
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by the scoring matrices in bytes (the memory-mapped re-rank vectors are not counted).
+        """
+        total = self.matrix.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        if self.full is not None and self.full is not self.matrix and not isinstance(self.full, np.memmap):
+            total += self.full.nbytes
+        return total
+
+    @property
+    def rerank_nbytes(self):
+        """
+        Size of the memory-mapped re-rank vectors in bytes; only the rows read per query become resident.
+        """
+        if isinstance(self.full, np.memmap) and self.full is not self.matrix:
+            return self.full.nbytes
+        return 0
+
+    def _approximate_top_k(self, queries, k):
+        """
+        Score queries against the gallery block by block and keep the k best rows per query.
+        :param queries: Normalized query matrix of shape (n_queries, dim), float32.
+        :param k: Number of candidates to keep.
+        :return: Tuple of (indices, scores), each of shape (n_queries, k).
+        """
+        n_queries = queries.shape[0]
+        best_idx = np.empty((n_queries, 0), dtype=np.int64)
+        best_scores = np.empty((n_queries, 0), dtype=np.float32)
+
+        # Quantized rows are dequantized into one reused buffer small enough to stay in cache,
+        # so only the compact matrix is streamed from memory
+        buffer = None
+        if self.precision != "float32":
+            buffer = np.empty((min(self.block_size, len(self)), self.matrix.shape[1]), dtype=np.float32)
+
+        for start in range(0, len(self), self.block_size):
+            rows = self.matrix[start:start + self.block_size]
+            if buffer is None:
+                block = rows
+            else:
+                block = buffer[:rows.shape[0]]
+                if self.scales is not None:
+                    np.multiply(rows, self.scales[start:start + self.block_size, None], out=block, casting="unsafe")
+                else:
+                    block[...] = rows
+            scores = queries @ block.T
+
+            if scores.shape[1] > k:
+                idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, idx, axis=1)
+            else:
+                idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+            best_idx = np.concatenate([best_idx, idx + start], axis=1)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+        return best_idx, best_scores
+
+    def match(self, embeddings):
+        """
+        Find the best gallery match for each query embedding.
+        :param embeddings: List of query embeddings.
+        :return: Tuple of (best_indices, best_scores) as numpy arrays, one entry per query.
+        """
+        if len(embeddings) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = queries / norms
+
+        k = max(1, min(self.rerank_k, len(self)))
+        candidates, scores = self._approximate_top_k(queries, k)
+
+        if self.rerank_k:
+            # Re-score the shortlisted candidates with the unquantized vectors, reading only those rows
+            rows = np.unique(candidates)
+            lookup = np.searchsorted(rows, candidates)
+            scores = np.einsum("qkd,qd->qk", np.asarray(self.full[rows])[lookup], queries)
+
+        best = np.argmax(scores, axis=1)
+        best_indices = np.take_along_axis(candidates, best[:, None], axis=1)[:, 0]
+        best_scores = np.take_along_axis(scores, best[:, None], axis=1)[:, 0]
+        return best_indices, best_scores.astype(np.float64)
@@ -1,4 +1,5 @@
 from insightface.app import FaceAnalysis
+import onnxruntime as ort
 import os 
 
 ''' RetinaFace uses feature maps with strides of 8, 16, and 32, 
@@ -8,11 +9,25 @@ import os
 '''
 
 class FaceDetector:
-    def __init__(self):
+    def __init__(self, intra_op_threads=os.getenv("ORT_INTRA_OP_THREADS"), inter_op_threads=os.getenv("ORT_INTER_OP_THREADS")):
         """
         Initialize the FaceDetector using InsightFace.
+        :param intra_op_threads: ONNX Runtime threads used inside an operator (None keeps the ORT default of all cores).
+        :param inter_op_threads: ONNX Runtime threads used across operators (None keeps the ORT default).
         """
         self.face_app = FaceAnalysis(name="buffalo_l", root="./")
+
+        if intra_op_threads or inter_op_threads:
+            # Several workers each using every core oversubscribe the CPU, so cap the thread pools per process.
+            # FaceAnalysis does not pass session options through, so the sessions are recreated with them.
+            sess_options = ort.SessionOptions()
+            if intra_op_threads:
+                sess_options.intra_op_num_threads = int(intra_op_threads)
+            if inter_op_threads:
+                sess_options.inter_op_num_threads = int(inter_op_threads)
+            for model in self.face_app.models.values():
+                model.session = ort.InferenceSession(model.model_file, sess_options=sess_options, providers=model.session.get_providers())
+
         self.face_app.prepare(ctx_id=-1, det_size=(1280, 1280))  # Adjust det_size as needed
         print("Models loaded:", self.face_app.models)
 
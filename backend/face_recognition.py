@@ -1,24 +1,31 @@
 import numpy as np
 from pymongo import MongoClient
-from scipy.spatial.distance import cosine
 from azure.storage.blob import BlobServiceClient
 import cv2
 from dotenv import load_dotenv
 import os
+from embedding_gallery import EmbeddingGallery
 
 load_dotenv()
 
 class FaceRecognition:
-    def __init__(self, mongo_uri=os.getenv('MONGO_URI'), db_name="AttendanceSystem", collection_name="Embeddings"):
+    def __init__(self, mongo_uri=os.getenv('MONGO_URI'), db_name="AttendanceSystem", collection_name="Embeddings", gallery_precision=os.getenv("GALLERY_PRECISION", "float32"), gallery_rerank_k=int(os.getenv("GALLERY_RERANK_K", 5)), preload_embeddings=True):
         """
         Initialize MongoDB connection and load embeddings.
+        :param gallery_precision: Precision of the section gallery used for matching ("float32", "float16" or "int8").
+        :param gallery_rerank_k: Candidates re-scored at full precision for float16/int8 galleries (0 disables re-ranking).
+        :param preload_embeddings: Load the legacy collection into known_embeddings; recognition reads the section collections instead.
         """
+        self.gallery_precision = gallery_precision
+        self.gallery_rerank_k = gallery_rerank_k
+        self.section_galleries = {}  # section -> (roster_version, EmbeddingGallery or None)
         self.client = MongoClient(mongo_uri)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
         self.known_labels = []
         self.known_embeddings = []
-        self.load_embeddings_from_db()
+        if preload_embeddings:
+            self.load_embeddings_from_db()
 
         # Initialize Azure Blob Storage client
         # Azure Storage Configuration
@@ -112,13 +119,50 @@ class FaceRecognition:
         
         return {"message": f"'{label}' has been successfully registered in section '{section}'."}
 
-    def recognize_faces(self, detections, embeddings,section):
+    def get_roster_version(self, section):
         """
-        Recognize faces by comparing embeddings to the database.
-        :param detections: List of detected face bounding boxes.
-        :param embeddings: List of detected face embeddings.
-        :param section: Section to search for matching faces.
-        :return: List of results with labels and confidence.
+        Get a version string for the section roster that changes whenever a person is added or removed.
+        :param section: Section whose roster version is requested.
+        :return: Version string built from the document count and the newest document id.
+        """
+        collection_name = f"Embeddings_{section}"
+        collection = self.db[collection_name]
+
+        count = collection.count_documents({})
+        latest = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        latest_id = latest["_id"] if latest else None
+        return f"{count}:{latest_id}"
+
+    def load_section_gallery(self, section):
+        """
+        Load the embeddings of a section into an EmbeddingGallery.
+        :param section: Section whose embeddings should be loaded.
+        :return: EmbeddingGallery, or None if the section has no embeddings.
+        """
+        return self.load_versioned_section_gallery(section)[1]
+
+    def get_section_gallery(self, section):
+        """
+        Get the gallery of a section, rebuilding it only when the roster version changed.
+        :param section: Section whose gallery is requested.
+        :return: EmbeddingGallery, or None if the section has no embeddings.
+        """
+        cached = self.section_galleries.get(section)
+        if cached is not None and cached[0] == self.get_roster_version(section):
+            return cached[1]
+
+        roster_version, gallery = self.load_versioned_section_gallery(section)
+        self.section_galleries[section] = (roster_version, gallery)
+        return gallery
+
+    def load_versioned_section_gallery(self, section, rerank_in_memory=False):
+        """
+        Load the embeddings of a section together with the roster version of the documents read.
+        The version matches get_roster_version for the same roster, but is derived from the loaded
+        documents, so it cannot describe a different roster than the gallery.
+        :param section: Section whose embeddings should be loaded.
+        :param rerank_in_memory: Keep the re-rank vectors in memory, e.g. when the caller persists the gallery itself.
+        :return: Tuple of (roster_version, EmbeddingGallery or None).
         """
         # Use the section-based collection
         collection_name = f"Embeddings_{section}"
@@ -127,27 +171,45 @@ class FaceRecognition:
         # Load embeddings and labels dynamically for the specified section
         section_embeddings = []
         section_labels = []
+        latest_id = None
         documents = collection.find()
 
         for doc in documents:
             section_embeddings.append(np.array(doc["embedding"]))
             section_labels.append(doc["label"])
-        
+            if latest_id is None or doc["_id"] > latest_id:
+                latest_id = doc["_id"]
+
+        roster_version = f"{len(section_embeddings)}:{latest_id}"
         if not section_embeddings:
+            return roster_version, None
+
+        return roster_version, EmbeddingGallery(section_embeddings, section_labels, precision=self.gallery_precision,
+                                                rerank_k=self.gallery_rerank_k, rerank_in_memory=rerank_in_memory)
+
+    def recognize_faces(self, detections, embeddings,section, gallery=None):
+        """
+        Recognize faces by comparing embeddings to the database.
+        :param detections: List of detected face bounding boxes.
+        :param embeddings: List of detected face embeddings.
+        :param section: Section to search for matching faces.
+        :param gallery: Optional EmbeddingGallery already loaded for the section.
+        :return: List of results with labels and confidence.
+        """
+        if gallery is None:
+            gallery = self.get_section_gallery(section)
+
+        if gallery is None:
             print(f"No embeddings found in section {section}.")
             return [(bbox, "Unknown", 0) for bbox in detections]
 
         # Performing recognition
-        results = []
-        for bbox, embedding in zip(detections, embeddings):
-
-            # Calculate similarity scores
-            similarities = [1 - cosine(embedding, known_emb) for known_emb in section_embeddings]
-            best_match_idx = np.argmax(similarities)
-            best_match_score = similarities[best_match_idx]
+        best_indices, best_scores = gallery.match(embeddings)
 
+        results = []
+        for bbox, best_match_idx, best_match_score in zip(detections, best_indices, best_scores):
             if best_match_score > 0.57:  # Threshold
-                label = section_labels[best_match_idx]
+                label = gallery.labels[best_match_idx]
                 results.append((bbox, label, best_match_score))
             else:
                 results.append((bbox, "Unknown", best_match_score))
@@ -1,9 +1,13 @@
 from fastapi import FastAPI, UploadFile, Form, HTTPException
+from contextlib import asynccontextmanager
+from functools import partial
 import uvicorn
 import cv2
 import os
 from face_detection import FaceDetector
 from face_recognition import FaceRecognition
+from recognition_cache import RecognitionCache
+from shared_gallery import SharedGalleryStore, clear_shared_galleries
 import numpy as np
 from fastapi.middleware.cors import CORSMiddleware
 import base64
@@ -12,16 +16,54 @@ from dotenv import load_dotenv
 from email_utils import send_attendance_email
 
 
-app = FastAPI()
 load_dotenv()
 
 # Azure Blob Storage configuration
 AZURE_STORAGE_CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 
-# Initialize Azure Blob Storage client
-blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
-container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+# Number of uvicorn worker processes; every worker imports this module and loads its own models.
+# `uvicorn main:app --workers N` does not tell the app N, so the core split below would not happen;
+# set WEB_CONCURRENCY=N instead (uvicorn reads it as its worker count) or ORT_INTRA_OP_THREADS.
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS") or os.getenv("WEB_CONCURRENCY") or 1)
+
+# Split the cores between workers unless the ONNX Runtime thread counts are set explicitly
+ORT_INTRA_OP_THREADS = os.getenv("ORT_INTRA_OP_THREADS")
+if ORT_INTRA_OP_THREADS is None and UVICORN_WORKERS > 1:
+    ORT_INTRA_OP_THREADS = max(1, (os.cpu_count() or 1) // UVICORN_WORKERS)
+
+# Created per worker in lifespan, so the uvicorn supervisor process never loads models or connects
+container_client = None
+face_detector = None
+face_recognition = None
+recognition_cache = None
+gallery_store = None
+gallery_loader = None
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Initialize the Azure client, face detector, recognition and caches when a worker starts.
+    """
+    global container_client, face_detector, face_recognition, recognition_cache, gallery_store, gallery_loader
+
+    # Initialize Azure Blob Storage client
+    blob_service_client = BlobServiceClient.from_connection_string(AZURE_STORAGE_CONNECTION_STRING)
+    container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+
+    # Initialize face detector and recognition
+    face_detector = FaceDetector(intra_op_threads=ORT_INTRA_OP_THREADS)
+    face_recognition = FaceRecognition(preload_embeddings=False)
+    recognition_cache = RecognitionCache()
+
+    # Section galleries are memory-mapped from files shared by all workers
+    gallery_store = SharedGalleryStore(precision=face_recognition.gallery_precision, rerank_k=face_recognition.gallery_rerank_k)
+    # The store writes the re-rank vectors to its own files, so the loader needn't spill them to a temp file first
+    gallery_loader = partial(face_recognition.load_versioned_section_gallery, rerank_in_memory=True)
+    yield
+    face_recognition.client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for React to communicate with FastAPI
 app.add_middleware(
@@ -32,10 +74,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize face detector and recognition
-face_detector = FaceDetector()
-face_recognition = FaceRecognition()
-
 # Create Results directory if it doesn't exist
 os.makedirs("Results", exist_ok=True)
 
@@ -71,13 +109,27 @@ async def detect_and_recognize(file: UploadFile,section:str=Form()):
         if frame is None:
             raise HTTPException(status_code=400, detail="Failed to process the image. Ensure the file is a valid image.")
 
-        # Detect and recognize faces
-        detections, embeddings = face_detector.detect_faces(frame)
+        # Re-submitted photos for an unchanged roster skip detection and recognition
+        roster_version = face_recognition.get_roster_version(section)
+        cache_key = RecognitionCache.make_key(contents, section, roster_version)
+        cached = recognition_cache.get(cache_key, section, roster_version)
+
+        if cached is not None:
+            detections = cached["detections"]
+            results = cached["results"]
+        else:
+            # Detect and recognize faces
+            detections, embeddings = face_detector.detect_faces(frame)
+
+            if detections:
+                gallery = gallery_store.get(section, roster_version, gallery_loader)
+                results = face_recognition.recognize_faces(detections, embeddings,section, gallery=gallery)
+            else:
+                results = []
+            recognition_cache.put(cache_key, section, roster_version, detections, embeddings, results)
 
         if not detections:
             raise HTTPException(status_code=400, detail="No faces detected in the image.")
-        
-        results = face_recognition.recognize_faces(detections, embeddings,section)
 
         # Draw bounding boxes
         draw_bounding_boxes(frame, results)
@@ -136,6 +188,12 @@ async def register_person(file: UploadFile, label: str = Form(...),Contact: int
         # Register the person
         message = face_recognition.register_person(frame, face_detector, label,Contact,section,email,rollNumber)
 
+        # The roster changed, so cached results for this section are stale
+        recognition_cache.invalidate_section(section)
+
+        # Publish the new roster to the shared gallery so the other workers pick it up
+        gallery_store.get(section, face_recognition.get_roster_version(section), gallery_loader)
+
         if message == "No face detected. Please try again.":  # No face detected
             raise HTTPException(status_code=400, detail="No face detected. Please try again.")
         else:
@@ -215,4 +273,11 @@ async def get_sections():
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="localhost", port=8000)
+    # Gallery files in /dev/shm outlive the process; start from a clean store before workers spawn
+    clear_shared_galleries()
+
+    if UVICORN_WORKERS > 1:
+        # Multiple workers need the app as an import string so each process can import it
+        uvicorn.run("main:app", host="localhost", port=8000, workers=UVICORN_WORKERS)
+    else:
+        uvicorn.run(app, host="localhost", port=8000)
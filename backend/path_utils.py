@@ -0,0 +1,13 @@
+import hashlib
+
+def section_key(section):
+    """
+    File-system safe name for a section, used by the on-disk caches.
+    Sanitizing alone would map different sections (e.g. "4 R" and "4_R") to the same name,
+    so a hash of the raw section string is appended to keep the mapping one-to-one.
+    :param section: Section name as received from the client.
+    :return: Name usable as a file or directory name.
+    """
+    safe_section = "".join(c if c.isalnum() or c in "-_" else "_" for c in section)
+    digest = hashlib.sha1(section.encode("utf-8")).hexdigest()[:12]
+    return f"{safe_section}-{digest}"
@@ -0,0 +1,216 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from path_utils import section_key
+
+load_dotenv()
+
+class RecognitionCache:
+    def __init__(self, max_entries=int(os.getenv("RECOGNITION_CACHE_SIZE", 128)), disk_dir=os.getenv("RECOGNITION_CACHE_DIR"),
+                 max_disk_bytes=int(os.getenv("RECOGNITION_CACHE_DISK_BYTES", 512 * 2**20))):
+        """
+        Content-addressed cache for detection and recognition results.
+        Entries live in an in-memory LRU and, if disk_dir is set, in .npz files on disk.
+        Disk entries hold only arrays and JSON text (no pickle), so a writable cache directory cannot inject code.
+        Disk entries are grouped per section and roster version, so entries of an old roster
+        can be removed by any worker sharing the directory.
+        :param max_entries: Maximum number of entries kept in memory.
+        :param disk_dir: Optional directory for the on-disk tier.
+        :param max_disk_bytes: Size cap of the on-disk tier; least recently used files are removed first.
+        """
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(contents, section, roster_version):
+        """
+        Build the cache key from the uploaded bytes, the section and its roster version.
+        :param contents: Raw bytes of the uploaded image.
+        :param section: Section of the classroom.
+        :param roster_version: Roster version string from FaceRecognition.get_roster_version.
+        :return: Hex digest identifying the request.
+        """
+        digest = hashlib.sha256(contents)
+        digest.update(f"|{section}|{roster_version}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _section_dir(self, section):
+        # Sections get their own sub-directory so a roster change can drop them in one go
+        return os.path.join(self.disk_dir, section_key(section))
+
+    def _version_dir(self, section, roster_version):
+        version_name = hashlib.sha1(str(roster_version).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self._section_dir(section), version_name)
+
+    def _disk_path(self, section, roster_version, key):
+        return os.path.join(self._version_dir(section, roster_version), f"{key}.npz")
+
+    @staticmethod
+    def _dump(value, f):
+        """
+        Write an entry as an .npz with the embeddings array and the detections and results as JSON text.
+        """
+        meta = {
+            "detections": [[float(v) for v in detection] for detection in value["detections"]],
+            "results": [[[float(v) for v in bbox], label, float(score)] for bbox, label, score in value["results"]],
+        }
+        embeddings = np.asarray(value["embeddings"], dtype=np.float32)
+        np.savez(f, embeddings=embeddings, meta=np.array(json.dumps(meta)))
+
+    @staticmethod
+    def _load(path):
+        """
+        Read an entry written by _dump, refusing pickled objects.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            embeddings = list(data["embeddings"])
+        # Bounding boxes are integer pixel coordinates followed by the detection score
+        detections = [[int(v) for v in detection[:4]] + [detection[4]] for detection in meta["detections"]]
+        results = [([int(v) for v in bbox[:4]] + bbox[4:], label, score) for bbox, label, score in meta["results"]]
+        return {"detections": detections, "embeddings": embeddings, "results": results}
+
+    def get(self, key, section, roster_version):
+        """
+        Look up a cached entry.
+        :param key: Key returned by make_key.
+        :param section: Section of the classroom.
+        :param roster_version: Roster version the key was built with.
+        :return: Dict with detections, embeddings and results, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        if self.disk_dir:
+            path = self._disk_path(section, roster_version, key)
+            try:
+                value = self._load(path)
+                os.utime(path)  # Mark as recently used for disk eviction
+            except FileNotFoundError:
+                value = None
+            except Exception as e:
+                print(f"Error reading recognition cache entry {path}: {e}")
+                value = None
+
+            if value is not None:
+                self._put_memory(key, section, roster_version, value)
+                with self.lock:
+                    self.hits += 1
+                return value
+
+        with self.lock:
+            self.misses += 1
+
+        # A miss is the first request after a roster change, so drop what the old rosters left behind
+        self._drop_stale_versions(section, roster_version)
+        return None
+
+    def put(self, key, section, roster_version, detections, embeddings, results):
+        """
+        Store the outcome of a detection and recognition run.
+        :param key: Key returned by make_key.
+        :param section: Section of the classroom.
+        :param roster_version: Roster version the key was built with.
+        :param detections: Detections returned by FaceDetector.detect_faces.
+        :param embeddings: Embeddings returned by FaceDetector.detect_faces.
+        :param results: Results returned by FaceRecognition.recognize_faces.
+        """
+        value = {"detections": detections, "embeddings": embeddings, "results": results}
+        self._put_memory(key, section, roster_version, value)
+
+        if self.disk_dir:
+            path = self._disk_path(section, roster_version, key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    self._dump(value, f)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Error writing recognition cache entry {path}: {e}")
+            self._enforce_disk_limit()
+
+    def _put_memory(self, key, section, roster_version, value):
+        with self.lock:
+            self.entries[key] = (section, roster_version, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _drop_stale_versions(self, section, roster_version):
+        """
+        Remove memory and disk entries of a section that belong to another roster version.
+        """
+        with self.lock:
+            stale_keys = [key for key, (entry_section, entry_version, _) in self.entries.items()
+                          if entry_section == section and entry_version != roster_version]
+            for key in stale_keys:
+                del self.entries[key]
+
+        if self.disk_dir:
+            section_dir = self._section_dir(section)
+            current = os.path.basename(self._version_dir(section, roster_version))
+            if os.path.isdir(section_dir):
+                for name in os.listdir(section_dir):
+                    if name != current:
+                        shutil.rmtree(os.path.join(section_dir, name), ignore_errors=True)
+
+    def _enforce_disk_limit(self):
+        """
+        Remove the least recently used disk entries until the tier fits in max_disk_bytes.
+        """
+        files = []
+        total = 0
+        for root, _, filenames in os.walk(self.disk_dir):
+            for filename in filenames:
+                if not filename.endswith(".npz"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total <= self.max_disk_bytes:
+            return
+
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
+
+    def invalidate_section(self, section):
+        """
+        Drop every cached entry for a section, e.g. after its roster changed.
+        :param section: Section whose entries should be removed.
+        """
+        with self.lock:
+            stale_keys = [key for key, (entry_section, _, _) in self.entries.items() if entry_section == section]
+            for key in stale_keys:
+                del self.entries[key]
+
+        if self.disk_dir:
+            shutil.rmtree(self._section_dir(section), ignore_errors=True)
@@ -0,0 +1,195 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+from embedding_gallery import EmbeddingGallery
+from path_utils import section_key
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, fine for a single worker
+    fcntl = None
+
+load_dotenv()
+
+def default_share_dir():
+    """
+    Prefer /dev/shm so the gallery files live in RAM; fall back to the temp directory.
+    """
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "gla_gallery")
+
+def default_rerank_dir():
+    return os.path.join(tempfile.gettempdir(), "gla_gallery_rerank")
+
+def clear_shared_galleries(share_dir=os.getenv("GALLERY_SHARE_DIR") or default_share_dir(),
+                           rerank_dir=os.getenv("GALLERY_RERANK_DIR") or default_rerank_dir()):
+    """
+    Remove every published gallery file and manifest. /dev/shm is RAM and survives restarts, so this
+    runs at supervisor start (python main.py) before any worker exists. Deployments that start
+    uvicorn directly should run it before launching, e.g.
+    python -c "import shared_gallery; shared_gallery.clear_shared_galleries()"
+    """
+    removed = 0
+    for directory in (share_dir, rerank_dir):
+        if not os.path.isdir(directory):
+            continue
+        for filename in os.listdir(directory):
+            if filename.endswith((".npy", ".json")):
+                try:
+                    os.remove(os.path.join(directory, filename))
+                    removed += 1
+                except OSError:
+                    pass
+    print(f"Cleared {removed} shared gallery files.")
+
+class SharedGalleryStore:
+    def __init__(self, precision=os.getenv("GALLERY_PRECISION", "float32"), rerank_k=int(os.getenv("GALLERY_RERANK_K", 5)),
+                 share_dir=os.getenv("GALLERY_SHARE_DIR") or default_share_dir(),
+                 rerank_dir=os.getenv("GALLERY_RERANK_DIR") or default_rerank_dir()):
+        """
+        Section galleries stored as .npy files and memory-mapped by every worker process,
+        so all workers read the same pages instead of each building its own copy.
+        Each section has a manifest per gallery variant (precision and re-rank setting) naming the
+        roster version and the files holding it; a worker that sees another roster version rebuilds
+        the files under an exclusive lock. Publishing removes the section's files of other variants;
+        clear_shared_galleries removes everything, e.g. for deleted sections.
+        :param precision: Gallery precision the loader builds ("float32", "float16" or "int8").
+        :param rerank_k: Re-rank candidates the loader builds the gallery with.
+        :param share_dir: Directory for the scoring matrices, ideally on a RAM-backed filesystem.
+        :param rerank_dir: Directory for the float32 re-rank vectors, on disk so they stay out of RAM.
+        """
+        self.precision = precision
+        self.rerank_k = rerank_k if precision != "float32" else 0
+        self.variant = precision if not self.rerank_k else f"{precision}_rerank{self.rerank_k}"
+        self.share_dir = share_dir
+        self.rerank_dir = rerank_dir
+        self.galleries = {}  # section -> (roster_version, gallery)
+        self.lock = threading.Lock()
+        os.makedirs(self.share_dir, exist_ok=True)
+        os.makedirs(self.rerank_dir, exist_ok=True)
+
+    def _name(self, section):
+        return f"{section_key(section)}.{self.variant}"
+
+    def _array_path(self, section, token, array_name):
+        directory = self.rerank_dir if array_name == "full" else self.share_dir
+        return os.path.join(directory, f"{self._name(section)}.{token}.{array_name}.npy")
+
+    @contextmanager
+    def _file_lock(self, section, exclusive):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.share_dir, f"{self._name(section)}.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self, section):
+        try:
+            with open(os.path.join(self.share_dir, f"{self._name(section)}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _attach(self, section, manifest):
+        """
+        Memory-map the arrays named in a manifest. Must be called while holding the section lock.
+        """
+        if not manifest["labels"]:
+            return None
+
+        arrays = {
+            name: np.load(self._array_path(section, manifest["token"], name), mmap_mode="r")
+            for name in manifest["arrays"]
+        }
+        return EmbeddingGallery.from_arrays(manifest["labels"], manifest["precision"], rerank_k=self.rerank_k, **arrays)
+
+    def _publish(self, section, roster_version, gallery):
+        """
+        Write a gallery under fresh file names, switch the manifest to it and remove the old files.
+        Must be called while holding the exclusive section lock.
+        :param roster_version: Roster version the gallery was actually loaded at.
+        """
+        name = self._name(section)
+        token = f"{int(time.time() * 1000)}_{os.getpid()}"
+        arrays = gallery.arrays() if gallery is not None else {}
+
+        for array_name, array in arrays.items():
+            np.save(self._array_path(section, token, array_name), np.ascontiguousarray(array))
+
+        manifest = {
+            "version": roster_version,
+            "token": token,
+            "precision": self.precision,
+            "labels": gallery.labels if gallery is not None else [],
+            "arrays": list(arrays),
+        }
+        tmp_path = os.path.join(self.share_dir, f"{name}.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self.share_dir, f"{name}.json"))
+
+        # Drop older files of this variant and every file of other variants (left by a precision
+        # or re-rank change); workers that still map old files keep them alive until they re-attach
+        section_prefix = f"{section_key(section)}."
+        for directory in (self.share_dir, self.rerank_dir):
+            for filename in os.listdir(directory):
+                if not filename.startswith(section_prefix):
+                    continue
+                stale_array = filename.endswith(".npy") and f".{token}." not in filename
+                other_manifest = filename.endswith(".json") and filename != f"{name}.json"
+                if stale_array or other_manifest:
+                    try:
+                        os.remove(os.path.join(directory, filename))
+                    except OSError:
+                        pass
+        return manifest
+
+    def get(self, section, roster_version, loader):
+        """
+        Get the shared gallery for a section at the given roster version.
+        The first worker to see a new roster version builds and publishes it; the rest attach to it.
+        :param section: Section of the classroom.
+        :param roster_version: Roster version string from FaceRecognition.get_roster_version.
+        :param loader: Callable returning (roster_version, EmbeddingGallery) for a section as actually read,
+            e.g. FaceRecognition.load_versioned_section_gallery. It must build galleries with this store's
+            precision and rerank_k.
+        :return: EmbeddingGallery backed by memory-mapped arrays, or None if the section has no embeddings.
+        """
+        with self.lock:
+            cached = self.galleries.get(section)
+        if cached is not None and cached[0] == roster_version:
+            return cached[1]
+
+        manifest = self._read_manifest(section)
+        if manifest is not None and manifest["version"] == roster_version:
+            with self._file_lock(section, exclusive=False):
+                manifest = self._read_manifest(section)
+                if manifest is not None and manifest["version"] == roster_version:
+                    gallery = self._attach(section, manifest)
+                    with self.lock:
+                        self.galleries[section] = (roster_version, gallery)
+                    return gallery
+
+        with self._file_lock(section, exclusive=True):
+            # Another worker may have published while we waited for the lock
+            manifest = self._read_manifest(section)
+            if manifest is None or manifest["version"] != roster_version:
+                loaded_version, gallery = loader(section)
+                # A caller with an outdated roster_version must not replace a manifest that is already current
+                if manifest is None or manifest["version"] != loaded_version:
+                    manifest = self._publish(section, loaded_version, gallery)
+                    print(f"Published shared gallery for section {section} ({len(manifest['labels'])} embeddings).")
+            gallery = self._attach(section, manifest)
+
+        with self.lock:
+            self.galleries[section] = (manifest["version"], gallery)
+        return gallery